@@ -1,12 +1,78 @@
-from fastapi import FastAPI, HTTPException, Depends 
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, conlist, model_validator
 from typing import List, Optional
+import logging
+import os
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+import orjson
+import redis.asyncio as redis
 from .security import verify_api_key
 
-app = FastAPI()
+# Connect over a unix socket when available (lower latency than TCP);
+# override with REDIS_URL for remote/containerized deployments.
+REDIS_URL = os.environ.get("REDIS_URL", "unix:///var/run/redis/redis.sock")
+
+# Pages expire automatically after a day so abandoned quizzes don't pile up.
+PAGE_TTL = 86400
+
+# Only the most recent answers are kept for the "recent answers" view;
+# the stats hash holds the authoritative aggregates, so memory per
+# question stays O(options) instead of O(students).
+ANSWER_HISTORY = 500
+
+logger = logging.getLogger(__name__)
+
+redis_client: redis.Redis = None  # initialized in lifespan
+
+# Re-checks `active` and records the answer in one atomic step, so an
+# answer can't slip in between close_question flipping the flag and the
+# counters being bumped (there is no cross-worker lock to take instead).
+# KEYS: page hash, answers list, stats hash
+# ARGV: answer json, is_correct ("1"/"0"), ttl, history size, option indices...
+RECORD_ANSWER_LUA = """
+local q = redis.call('HGET', KEYS[1], 'current_question')
+if not q or cjson.decode(q)['active'] ~= true then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('LTRIM', KEYS[2], -ARGV[4], -1)
+redis.call('HINCRBY', KEYS[3], 'total', 1)
+if ARGV[2] == '1' then
+    redis.call('HINCRBY', KEYS[3], 'correct', 1)
+end
+for i = 5, #ARGV do
+    redis.call('HINCRBY', KEYS[3], 'option:' .. ARGV[i], 1)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return 1
+"""
+
+record_answer = None  # registered against the client in lifespan
+
+
+def _isoformat(ts) -> str:
+    # Timestamps are stored as raw time.time() floats (cheap to produce in
+    # the hot answer path); format them only when a client reads them back
+    return datetime.fromtimestamp(float(ts), tz=timezone.utc).isoformat()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client, record_answer
+    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+    record_answer = redis_client.register_script(RECORD_ANSWER_LUA)
+    yield
+    await redis_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,73 +82,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-active_pages = {}  # {page_id: {current_question: None, answers: [], ...}}
-
 
 class Option(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_max_length=10_000)
+
     text: str
     is_correct: bool
     html: Optional[str] = None  # Allow HTML content for rich markdown
 
 
 class Question(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_max_length=10_000)
+
     text: str
-    options: List[Option]
+    # Capped at 64 options: correct_mask packs them into a single integer,
+    # and option_indices carries the same bound on the answer side
+    options: conlist(Option, min_length=1, max_length=64)
     allow_multiple: bool = False  # For multiple choice questions
     html: Optional[str] = None  # Allow HTML content for the question
 
 
 class Page(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_max_length=10_000)
+
     title: str
     description: str
 
 
 class StudentAnswer(BaseModel):
-    option_indices: List[int]  # List of selected options
+    model_config = ConfigDict(extra="forbid")
 
+    option_indices: conlist(int, min_length=1, max_length=64)  # Selected options
 
-@app.post("/api/pages/", response_model=dict)
-async def create_page(page: Page, api_key: str = Depends(verify_api_key)):
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_single_choice(cls, data):
+        # Older single-choice clients send {"option_index": int}
+        if isinstance(data, dict) and "option_index" in data and "option_indices" not in data:
+            data = dict(data)
+            data["option_indices"] = [data.pop("option_index")]
+        return data
+
+
+@app.post("/api/pages/", response_model=dict, dependencies=[Depends(verify_api_key)])
+async def create_page(page: Page):
     page_id = str(uuid.uuid4())
-    active_pages[page_id] = {
-        "title": page.title,
-        "description": page.description,
-        "current_question": None,
-        "answers": [],
-        "created_at": datetime.now().isoformat(),
-    }
+    pipe = redis_client.pipeline()
+    pipe.hset(
+        f"page:{page_id}",
+        mapping={
+            "title": page.title,
+            "description": page.description,
+            "created_at": time.time(),
+            "version": 0,
+        },
+    )
+    pipe.expire(f"page:{page_id}", PAGE_TTL)
+    await pipe.execute()
     return {"page_id": page_id}
 
 
 @app.get("/api/pages/{page_id}")
-async def get_page_status(page_id: str):
-    if page_id not in active_pages:
+async def get_page_status(page_id: str, request: Request):
+    # Fetch exactly the fields the response carries — no HGETALL of the
+    # full hash, no intermediate dict copies to strip afterwards
+    title, description, created_at, version, public_json = await redis_client.hmget(
+        f"page:{page_id}",
+        "title", "description", "created_at", "version", "public_question",
+    )
+    if title is None:
         raise HTTPException(status_code=404, detail="Page not found")
 
-    # Don't expose correct answers to students
-    page_data = active_pages[page_id].copy()
-    if page_data["current_question"]:
-        sanitized_question = page_data["current_question"].copy()
-        sanitized_question["options"] = [
-            {"text": opt["text"], "html": opt.get("html")} for opt in sanitized_question["options"]
-        ]
-        # Include the allow_multiple flag and HTML content
-        print(f"page_data: {page_data}")
-        print(f"allow multiple: {page_data['current_question'].get('allow_multiple', False)}")
-        sanitized_question["allow_multiple"] = page_data["current_question"].get("allow_multiple", False)
-        if "html" in page_data["current_question"]:
-            sanitized_question["html"] = page_data["current_question"]["html"]
-        
-        page_data["current_question"] = sanitized_question
-
-    return page_data
-
-
-@app.post("/api/pages/{page_id}/questions")
-async def post_question(
-    page_id: str, question: Question, api_key: str = Depends(verify_api_key)
-):
-    if page_id not in active_pages:
+    # The version field only moves when the public view changes, so most
+    # polls between question transitions can be answered with an empty 304
+    etag = f'W/"{page_id}:{version or 0}"'
+    if request.headers.get("if-none-match") == etag:
+        # RFC 7232: a 304 carries the same ETag the 200 would have
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # The student-safe view was built once in post_question (created_at
+    # already ISO-formatted); serve it as-is
+    if public_json is not None:
+        public_question = orjson.loads(public_json)
+    else:
+        public_question = None
+
+    return ORJSONResponse(
+        {
+            "title": title,
+            "description": description,
+            "created_at": _isoformat(created_at),
+            "current_question": public_question,
+        },
+        headers={"ETag": etag},
+    )
+
+
+@app.post("/api/pages/{page_id}/questions", dependencies=[Depends(verify_api_key)])
+async def post_question(page_id: str, question: Question):
+    if not await redis_client.exists(f"page:{page_id}"):
         raise HTTPException(status_code=404, detail="Page not found")
 
     # Validate that at least one option is marked as correct
@@ -95,98 +193,163 @@ async def post_question(
         "text": question.text,
         "options": [
             {
-                "text": opt.text, 
+                "text": opt.text,
                 "is_correct": opt.is_correct,
                 **({"html": opt.html} if opt.html else {})
-            } 
+            }
             for opt in question.options
         ],
         "allow_multiple": question.allow_multiple or len([opt for opt in question.options if opt.is_correct]) > 1,
-        "created_at": datetime.now().isoformat(),
+        # Bitmask of correct options, precomputed so post_answer can grade
+        # with a single integer comparison
+        "correct_mask": sum(1 << i for i, opt in enumerate(question.options) if opt.is_correct),
+        "num_options": len(question.options),
+        "created_at": time.time(),
         "active": True,
     }
-    print(f"POST allow multiple: {question.allow_multiple}")
-    print(f"POST question_data: {question}")
-    # question_data["allow_multiple"] = len([opt for opt in question.options if opt.is_correct]) > 1
-    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"posting question to page {page_id}: {question_data}")
+
     # Add HTML content if provided
     if question.html:
         question_data["html"] = question.html
 
-    active_pages[page_id]["current_question"] = question_data
-    active_pages[page_id]["answers"] = []
+    # Build the student-facing view once, up front, so get_page_status
+    # doesn't re-sanitize the question on every poll
+    public_question = {
+        "text": question_data["text"],
+        "options": [{"text": opt.text, "html": opt.html} for opt in question.options],
+        "allow_multiple": question_data["allow_multiple"],
+        # Stored pre-formatted: this view is built once but served many
+        # times, over both HTTP and WebSocket, in the same wire format
+        "created_at": _isoformat(question_data["created_at"]),
+        "active": True,
+    }
+    if question.html:
+        public_question["html"] = question.html
+
+    pipe = redis_client.pipeline()
+    pipe.hset(f"page:{page_id}", "current_question", orjson.dumps(question_data))
+    pipe.hset(f"page:{page_id}", "public_question", orjson.dumps(public_question))
+    pipe.delete(f"page:{page_id}:answers", f"page:{page_id}:stats")
+    # Allocate the counters up front so the stats hash always carries the
+    # full shape of the question, even before the first answer lands
+    pipe.hset(
+        f"page:{page_id}:stats",
+        mapping={
+            "total": 0,
+            "correct": 0,
+            **{f"option:{i}": 0 for i in range(len(question.options))},
+        },
+    )
+    pipe.hincrby(f"page:{page_id}", "version", 1)
+    pipe.expire(f"page:{page_id}", PAGE_TTL)
+    pipe.expire(f"page:{page_id}:stats", PAGE_TTL)
+    await pipe.execute()
+
+    # Serialized once here; pub/sub fans it out to subscribers on every worker
+    await redis_client.publish(
+        f"page:{page_id}:events",
+        orjson.dumps({"event": "question", "question": public_question}),
+    )
 
     return {"status": "success"}
 
 
 @app.post("/api/pages/{page_id}/answers")
 async def post_answer(page_id: str, answer: StudentAnswer):
-    if page_id not in active_pages:
-        raise HTTPException(status_code=404, detail="Page not found")
+    question_json = await redis_client.hget(f"page:{page_id}", "current_question")
+    if question_json is None:
+        if not await redis_client.exists(f"page:{page_id}"):
+            raise HTTPException(status_code=404, detail="Page not found")
+        raise HTTPException(status_code=400, detail="No active question")
 
-    page = active_pages[page_id]
-    if not page["current_question"] or not page["current_question"]["active"]:
+    question = orjson.loads(question_json)
+    if not question["active"]:
         raise HTTPException(status_code=400, detail="No active question")
 
     # Validate that option indices are valid
-    num_options = len(page["current_question"]["options"])
+    num_options = question["num_options"]
     for idx in answer.option_indices:
         if idx < 0 or idx >= num_options:
             raise HTTPException(status_code=400, detail=f"Invalid option index: {idx}")
 
     # If not a multiple choice question, validate that only one option is selected
-    if not page["current_question"].get("allow_multiple", False) and len(answer.option_indices) > 1:
+    if not question.get("allow_multiple", False) and len(answer.option_indices) > 1:
         raise HTTPException(status_code=400, detail="Multiple selections not allowed for this question")
-    
-    # Calculate if the answer is correct based on selected options
-    # For multiple choice: all correct options must be selected and no incorrect ones
-    if page["current_question"].get("allow_multiple", False):
-        # Get all indices for correct options
-        correct_indices = [
-            i for i, opt in enumerate(page["current_question"]["options"]) 
-            if opt["is_correct"]
-        ]
-        # Check if selected options match exactly with correct options
-        is_correct = set(answer.option_indices) == set(correct_indices)
-    else:
-        # For single choice, just check if the selected option is correct
-        is_correct = page["current_question"]["options"][answer.option_indices[0]]["is_correct"] if answer.option_indices else False
+
+    # Grade by comparing bitmasks: all correct options selected and no
+    # incorrect ones. Single-choice questions have exactly one correct
+    # option (more would have forced allow_multiple), so the same
+    # comparison covers both cases.
+    sel_mask = 0
+    for idx in answer.option_indices:
+        sel_mask |= 1 << idx
+    is_correct = sel_mask == question["correct_mask"]
+
+    # Duplicates collapse in the mask but would inflate the per-option
+    # counters; feed the stats script the distinct selections only, so each
+    # option counts at most once per answer
+    selected_options = [i for i in range(num_options) if (sel_mask >> i) & 1]
 
     # Record the answer
     answer_data = {
         "option_indices": answer.option_indices,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": time.time(),
         "is_correct": is_correct,
     }
-    page["answers"].append(answer_data)
+    # Push the answer and bump the counters atomically; the script re-checks
+    # `active` server-side so answers can't land after close_question
+    recorded = await record_answer(
+        keys=[f"page:{page_id}", f"page:{page_id}:answers", f"page:{page_id}:stats"],
+        args=[
+            orjson.dumps(answer_data),
+            "1" if is_correct else "0",
+            PAGE_TTL,
+            ANSWER_HISTORY,
+            *selected_options,
+        ],
+    )
+    if not recorded:
+        raise HTTPException(status_code=400, detail="No active question")
 
     return {"status": "success"}
 
 
-@app.post("/api/pages/{page_id}/close-question")
-async def close_question(page_id: str, api_key: str = Depends(verify_api_key)):
-    if page_id not in active_pages:
-        raise HTTPException(status_code=404, detail="Page not found")
-
-    page = active_pages[page_id]
-    if not page["current_question"]:
+@app.post("/api/pages/{page_id}/close-question", dependencies=[Depends(verify_api_key)])
+async def close_question(page_id: str):
+    question_json = await redis_client.hget(f"page:{page_id}", "current_question")
+    if question_json is None:
+        if not await redis_client.exists(f"page:{page_id}"):
+            raise HTTPException(status_code=404, detail="Page not found")
         raise HTTPException(status_code=400, detail="No active question")
 
-    page["current_question"]["active"] = False
-
-    # Calculate statistics
-    total_answers = len(page["answers"])
-    correct_answers = sum(1 for ans in page["answers"] if ans["is_correct"])
-
-    # Calculate option selection statistics
-    option_stats = {}
-    for i, _ in enumerate(page["current_question"]["options"]):
-        # Count how many times each option was selected
-        count = sum(1 for ans in page["answers"] if i in ans["option_indices"])
-        option_stats[i] = {
-            "count": count,
-            "is_correct": page["current_question"]["options"][i]["is_correct"],
+    question = orjson.loads(question_json)
+    question["active"] = False
+    pipe = redis_client.pipeline()
+    pipe.hset(f"page:{page_id}", "current_question", orjson.dumps(question))
+    # Keep the precomputed student view in sync
+    public_json = await redis_client.hget(f"page:{page_id}", "public_question")
+    if public_json is not None:
+        public_question = orjson.loads(public_json)
+        public_question["active"] = False
+        pipe.hset(f"page:{page_id}", "public_question", orjson.dumps(public_question))
+    pipe.hincrby(f"page:{page_id}", "version", 1)
+    await pipe.execute()
+
+    # Counters are maintained incrementally in post_answer, so the stats
+    # are a single hash read regardless of how many answers came in
+    counters = await redis_client.hgetall(f"page:{page_id}:stats")
+    total_answers = int(counters.get("total", 0))
+    correct_answers = int(counters.get("correct", 0))
+
+    option_stats = {
+        i: {
+            "count": int(counters.get(f"option:{i}", 0)),
+            "is_correct": opt["is_correct"],
         }
+        for i, opt in enumerate(question["options"])
+    }
 
     stats = {
         "total_answers": total_answers,
@@ -204,13 +367,64 @@ async def close_question(page_id: str, api_key: str = Depends(verify_api_key)):
             }
             for i, stats in option_stats.items()
         },
-        "is_multiple_choice": page["current_question"].get("allow_multiple", False)
+        "is_multiple_choice": question.get("allow_multiple", False)
     }
 
+    await redis_client.publish(
+        f"page:{page_id}:events",
+        orjson.dumps({"event": "question_closed"}),
+    )
+
     return stats
 
 
+@app.websocket("/ws/pages/{page_id}")
+async def page_events(websocket: WebSocket, page_id: str):
+    """Push question state to students instead of having them poll.
+
+    Events are relayed through Redis pub/sub so a broadcast reaches
+    subscribers connected to any worker, and each event is serialized
+    once by the publisher rather than once per connection.
+    """
+    if not await redis_client.exists(f"page:{page_id}"):
+        await websocket.close(code=1008, reason="Page not found")
+        return
+
+    await websocket.accept()
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(f"page:{page_id}:events")
+    try:
+        # Send the current state first (after subscribing, so nothing
+        # published in between can be missed)
+        public_json = await redis_client.hget(f"page:{page_id}", "public_question")
+        if public_json is not None:
+            # Splice the stored JSON straight into the envelope; it is
+            # already serialized, no point decoding and re-encoding it
+            await websocket.send_text(
+                f'{{"event": "question", "question": {public_json}}}'
+            )
+
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                await websocket.send_text(message["data"])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await pubsub.unsubscribe(f"page:{page_id}:events")
+        await pubsub.aclose()
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Page state lives in Redis, so workers can scale with the machine
+    uvicorn.run(
+        "backend.app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=1000,
+        timeout_keep_alive=30,
+    )
@@ -1,17 +1,25 @@
 # from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization
-from cryptography.exceptions import InvalidSignature
-import base64
-import json
-from datetime import datetime
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+import orjson
+import pybase64
+import time
+from datetime import date
+from functools import lru_cache
 from pathlib import Path
 
 from fastapi import HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
 
-# Load public key once at startup
-PUBLIC_KEY = serialization.load_pem_public_key(
+# Load public key once at startup; verification itself goes through
+# libsodium (PyNaCl), which is about twice as fast per verify as the
+# OpenSSL EVP path in `cryptography`
+_public_key = serialization.load_pem_public_key(
     Path('public.pem').read_bytes()
 )
+VERIFY_KEY = VerifyKey(_public_key.public_bytes(Encoding.Raw, PublicFormat.Raw))
 
 class InvalidAPIKey(HTTPException):
     INVALID_KEY_MSG = "Invalid API key"
@@ -25,41 +33,71 @@ class ExpiredAPIKey(HTTPException):
 
 # todo: revoked key exception
 
-def verify_api_key(api_key: str = Header(...)):
+_today_cache = (0, 0.0)  # (YYYYMMDD as int, unix time it goes stale)
+
+def _today_int() -> int:
+    # Rebuilding today's date costs an allocation per request; cache the
+    # integer for 60s so the expiry check is just an int compare
+    global _today_cache
+    today_i, fresh_until = _today_cache
+    now = time.time()
+    if now >= fresh_until:
+        d = date.today()
+        today_i = d.year * 10000 + d.month * 100 + d.day
+        _today_cache = (today_i, now + 60)
+    return today_i
+
+@lru_cache(maxsize=4096)
+def _verify_signature(api_key: str) -> dict:
+    """Decode and signature-check a token, returning its payload.
+
+    Cached because the Ed25519 verify is ~50-100µs of pure CPU and admin
+    clients resend the same token on every request. Expiry is checked by
+    the caller on every hit so a cached entry can't outlive its date, and
+    failures raise (never cached).
+    """
     try:
-        # Decode the entire token at once
-        raw_data = base64.b64decode(api_key)
-        
+        # Decode the entire token at once (pybase64 = SIMD base64)
+        raw_data = pybase64.b64decode(api_key, validate=True)
+
         # Ed25519 signatures are exactly 64 bytes
         SIGNATURE_SIZE = 64
-        
-        # Split the raw data into payload and signature
-        payload_bytes = raw_data[:-SIGNATURE_SIZE]
-        signature = raw_data[-SIGNATURE_SIZE:]
-        
-        # Parse the payload
-        payload = json.loads(payload_bytes)
-        
+
+        # Split via memoryview so the JSON parse reads the payload in place;
+        # only the signature is materialized (PyNaCl wants real bytes)
+        mv = memoryview(raw_data)
+        payload_bytes = mv[:-SIGNATURE_SIZE]
+        signature = bytes(mv[-SIGNATURE_SIZE:])
+
+        # Parse the payload (orjson accepts the memoryview directly)
+        payload = orjson.loads(payload_bytes)
+
         # Check required fields
         if not all(k in payload for k in ['t', 'e', 'x']):
             raise InvalidAPIKey()
 
-        # Verify dates
-        today = datetime.now().strftime('%Y%m%d')
-        if payload['x'] < today:
-            raise ExpiredAPIKey()
-            
         # Verify signature
         try:
-            PUBLIC_KEY.verify(signature, payload_bytes)
+            VERIFY_KEY.verify(bytes(payload_bytes), signature)
             return {
                 'tid': payload['t'],
                 'email': payload['e'],
-                'expires': payload['x']
+                'expires': int(payload['x'])
             }
-        except InvalidSignature:
+        except BadSignatureError:
             raise InvalidAPIKey()
-            
-    except (ValueError, KeyError, json.JSONDecodeError):
+
+    except (ValueError, KeyError, orjson.JSONDecodeError):
         raise InvalidAPIKey()
 
+
+async def verify_api_key(api_key: str = Header(...)):
+    # The decode + Ed25519 verify on a cache miss is blocking CPU work;
+    # run it in the threadpool so the event loop keeps serving requests
+    result = await run_in_threadpool(_verify_signature, api_key)
+
+    # Verify dates (on every call, never from the cache)
+    if result['expires'] < _today_int():
+        raise ExpiredAPIKey()
+
+    return result